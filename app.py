@@ -3,94 +3,139 @@ import streamlit as st
 from zipfile import ZipFile
 from io import BytesIO
 from pathlib import Path
-from datetime import datetime
-import tempfile
-import shutil
+from datetime import date, datetime
+from types import MappingProxyType
+from typing import Final
 import re
-from docx import Document
 
 # ---------- Configuration ----------
-TEMPLATES_ZIP_PATH = "./02_Templates-20251119T041237Z-1-001.zip"
-ARIZONA_FOLDER_NAME = "Arizona Templates"
+TEMPLATES_ZIP_PATH: Final = "./02_Templates-20251119T041237Z-1-001.zip"
+ARIZONA_FOLDER_NAME: Final = "Arizona Templates"
 
 # Updated template filenames (pdf.docx endings)
-TEMPLATE_FILENAME_MAP = {
+TEMPLATE_FILENAME_MAP: Final = MappingProxyType({
     ("Progress", False): "CONDITIONAL WAIVER AND RELEASE ON PROGRESS PAYMENT.pdf.docx",
     ("Progress", True):  "UNCONDITIONAL WAIVER AND RELEASE ON PROGRESS PAYMENT.pdf.docx",
     ("Final", False):    "CONDITIONAL WAIVER AND RELEASE ON FINAL PAYMENT.pdf.docx",
     ("Final", True):     "UNCONDITIONAL WAIVER AND RELEASE ON FINAL PAYMENT. PDF.docx",
-}
+})
 
 # ---------- Utilities ----------
+SESSION_DEFAULTS: Final = MappingProxyType({
+    "step": 0,
+    "state": "",
+    "compliance_ack": False,
+    "role": "",
+    "payment_type": "",
+    "payment_received": "",
+    "first_delivery_date": None,
+    "project_name": "",
+    "project_address": "",
+    "owner_name": "",
+    "contractor_name": "",
+    "payment_amount_raw": "",
+    "invoice_number": "",
+    "job_description": "",
+    "job_start_date": None,
+    "job_end_date": None,
+    "generated_file_bytes": None,
+    "generated_filename": None,
+})
+
 def init_session():
-    if "step" not in st.session_state:
-        st.session_state.step = 0
-    defaults = {
-        "state": "",
-        "compliance_ack": False,
-        "role": "",
-        "payment_type": "",
-        "payment_received": "",
-        "first_delivery_date": None,
-        "project_name": "",
-        "project_address": "",
-        "owner_name": "",
-        "contractor_name": "",
-        "payment_amount_raw": "",
-        "invoice_number": "",
-        "job_description": "",
-        "job_start_date": None,
-        "job_end_date": None,
-        "generated_file_bytes": None,
-        "generated_filename": None,
-    }
-    for k, v in defaults.items():
-        if k not in st.session_state:
-            st.session_state[k] = v
+    for k, v in SESSION_DEFAULTS.items():
+        st.session_state.setdefault(k, v)
+
+_CURRENCY_CLEAN_RE = re.compile(r"[^\d.\-]")
 
 def currency_format(raw_str):
     if raw_str is None:
         return "$0.00"
-    cleaned = re.sub(r"[^\d.\-]", "", str(raw_str))
+    cleaned = _CURRENCY_CLEAN_RE.sub("", str(raw_str))
     try:
         val = float(cleaned)
-    except:
+    except ValueError:
         return f"${raw_str}"
     return f"${val:,.2f}"
 
 def safe_filename(text):
     return re.sub(r"[^\w\-_\. ]", "", text).replace(" ", "_")
 
-def replace_docx_placeholders(doc: Document, replacements: dict):
-    for p in doc.paragraphs:
-        full_text = "".join([r.text for r in p.runs])
-        new_text = full_text
-        for key, val in replacements.items():
-            new_text = re.sub(r"\[" + re.escape(key) + r"\]", str(val), new_text)
-            new_text = re.sub(r"\{" + re.escape(key) + r"\}", str(val), new_text)
-            new_text = new_text.replace(key, str(val))
-        if new_text != full_text:
-            for i in range(len(p.runs)-1, -1, -1):
-                p.runs[i].clear()
-            if len(p.runs) == 0:
-                p.add_run(new_text)
-            else:
-                p.runs[0].text = new_text
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                cell_text = "".join([p.text for p in cell.paragraphs])
-                new_cell_text = cell_text
-                for key, val in replacements.items():
-                    new_cell_text = re.sub(r"\[" + re.escape(key) + r"\]", str(val), new_cell_text)
-                    new_cell_text = re.sub(r"\{" + re.escape(key) + r"\}", str(val), new_cell_text)
-                    new_cell_text = new_cell_text.replace(key, str(val))
-                if new_cell_text != cell_text:
-                    for p in cell.paragraphs:
-                        p.clear()
-                    cell.paragraphs[0].add_run(new_cell_text)
+def format_date(d):
+    return d.strftime("%B %d, %Y") if d else ""
+
+# Keys produced by build_replacement_map(); keep the compiled pattern in sync.
+PLACEHOLDER_KEYS = (
+    "OWNER", "Owner", "OWNER_NAME",
+    "CONTRACTOR", "Contractor", "CONTRACTOR_NAME",
+    "PROJECT", "Project", "PROJECT_NAME",
+    "PROJECT_ADDRESS", "ADDRESS",
+    "AMOUNT", "Amount", "PAYMENT_AMOUNT",
+    "INVOICE", "INVOICE_NUMBER",
+    "JOB_DESCRIPTION", "JOB",
+    "FIRST_DELIVERY_DATE", "JOB_START_DATE", "JOB_END_DATE",
+    "DATE",
+    "_____",
+)
+
+# Matches [KEY], {KEY} or bare KEY for every placeholder key in one pass.
+# Keys are ordered longest-first so a short key never shadows a longer one
+# that starts with it (e.g. PROJECT vs PROJECT_ADDRESS).
+_PLACEHOLDER_RE = re.compile(
+    "|".join(
+        rf"\[{re.escape(k)}\]|\{{{re.escape(k)}\}}|{re.escape(k)}"
+        for k in sorted(PLACEHOLDER_KEYS, key=len, reverse=True)
+    )
+)
+
+def substitute_placeholders(text, replacements):
+    def _sub(m):
+        token = m.group(0)
+        key = token[1:-1] if token[0] in "[{" else token
+        return str(replacements.get(key, token))
+    return _PLACEHOLDER_RE.sub(_sub, text)
+
+def fill_paragraph(p, replacements):
+    from docx.oxml.ns import qn
+
+    text_nodes = p._p.findall(f".//{qn('w:t')}")
+    full_text = "".join(t.text or "" for t in text_nodes)
+    # Most template paragraphs are boilerplate with no placeholder; a single
+    # search skips them without building a substituted copy.
+    if not _PLACEHOLDER_RE.search(full_text):
+        return
+    new_text = substitute_placeholders(full_text, replacements)
+    if new_text == full_text:
+        return
+    # Fast path: placeholders contained in a single w:t node are rewritten
+    # directly on the lxml element, skipping run wrapper construction while
+    # preserving run formatting.
+    for t in text_nodes:
+        if t.text and _PLACEHOLDER_RE.search(t.text):
+            t.text = substitute_placeholders(t.text, replacements)
+    if "".join(t.text or "" for t in text_nodes) == new_text:
+        return
+    # Slow path: a placeholder spans run boundaries; collapse to one run.
+    for i in range(len(p.runs)-1, -1, -1):
+        p.runs[i].clear()
+    if len(p.runs) == 0:
+        p.add_run(new_text)
+    else:
+        p.runs[0].text = new_text
+
+def replace_docx_placeholders(doc, replacements: dict):
+    from docx.oxml.ns import qn
+    from docx.text.paragraph import Paragraph
+
+    # A single lxml walk over the body yields every paragraph, including
+    # those nested in table cells, replacing the separate paragraphs and
+    # tables/rows/cells traversals. Cells get the same run-preserving
+    # treatment as body paragraphs instead of being collapsed wholesale.
+    for p_el in doc.element.body.iter(qn("w:p")):
+        fill_paragraph(Paragraph(p_el, doc), replacements)
 
 def build_replacement_map():
+    amount = currency_format(st.session_state.payment_amount_raw)
     mapping = {}
     mapping["OWNER"] = st.session_state.owner_name
     mapping["Owner"] = st.session_state.owner_name
@@ -103,21 +148,34 @@ def build_replacement_map():
     mapping["PROJECT_NAME"] = st.session_state.project_name
     mapping["PROJECT_ADDRESS"] = st.session_state.project_address
     mapping["ADDRESS"] = st.session_state.project_address
-    mapping["AMOUNT"] = currency_format(st.session_state.payment_amount_raw)
-    mapping["Amount"] = currency_format(st.session_state.payment_amount_raw)
-    mapping["PAYMENT_AMOUNT"] = currency_format(st.session_state.payment_amount_raw)
+    mapping["AMOUNT"] = amount
+    mapping["Amount"] = amount
+    mapping["PAYMENT_AMOUNT"] = amount
     mapping["INVOICE"] = st.session_state.invoice_number
     mapping["INVOICE_NUMBER"] = st.session_state.invoice_number
     mapping["JOB_DESCRIPTION"] = st.session_state.job_description
     mapping["JOB"] = st.session_state.job_description
-    mapping["FIRST_DELIVERY_DATE"] = st.session_state.first_delivery_date.strftime("%B %d, %Y") if st.session_state.first_delivery_date else ""
-    mapping["JOB_START_DATE"] = st.session_state.job_start_date.strftime("%B %d, %Y") if st.session_state.job_start_date else ""
-    mapping["JOB_END_DATE"] = st.session_state.job_end_date.strftime("%B %d, %Y") if st.session_state.job_end_date else ""
-    mapping["DATE"] = datetime.now().strftime("%B %d, %Y")
+    mapping["FIRST_DELIVERY_DATE"] = format_date(st.session_state.first_delivery_date)
+    mapping["JOB_START_DATE"] = format_date(st.session_state.job_start_date)
+    mapping["JOB_END_DATE"] = format_date(st.session_state.job_end_date)
+    mapping["DATE"] = date.today().strftime("%B %d, %Y")
     mapping["_____"] = ""
     return mapping
 
 # ---------- UI Helpers ----------
+STATE_OPTIONS: Final = ("-- Select --", "Arizona", "Other")
+ROLE_OPTIONS: Final = ("", "Owner", "Contractor", "Subcontractor", "Supplier", "Other")
+PAYMENT_TYPE_OPTIONS: Final = ("Progress", "Final")
+PAYMENT_RECEIVED_OPTIONS: Final = ("Yes", "No")
+
+DOCX_MIME: Final = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+AZ_COMPLIANCE_MD: Final = """
+        **Short summary:** Arizona has specific rules for construction waivers/releases and lien notices.
+        This tool provides a fillable waiver/release based on the form templates for Arizona.
+        Make sure you review the generated document for legal accuracy for your project, and consult counsel when necessary.
+        """
+
 def step_navigation(can_go_next=True):
     cols = st.columns([1, 1, 1])
     with cols[0]:
@@ -132,6 +190,7 @@ def step_navigation(can_go_next=True):
     st.markdown("---")
 
 # ---------- Steps ----------
+@st.fragment
 def step_welcome():
     st.header("Welcome to Lienify Waiver and Lien Form Generator")
     st.caption("A simple step-by-step generator for Arizona waiver & release forms.")
@@ -142,11 +201,12 @@ def step_welcome():
     st.write("")
     st.markdown("---")
 
+@st.fragment
 def step_state_selection():
     st.header("State Selection")
     st.caption("Currently we support Arizona. Select your state to continue.")
     st.write("")
-    state = st.selectbox("Choose your state", options=["-- Select --", "Arizona", "Other"], key="state_select_az")
+    state = st.selectbox("Choose your state", options=STATE_OPTIONS, key="state_select_az")
     st.session_state.state = state
     if state == "Arizona":
         st.success("Arizona selected. Proceeding to compliance.")
@@ -163,16 +223,11 @@ def step_state_selection():
         st.info("Please select your state to continue.")
         step_navigation(can_go_next=False)
 
+@st.fragment
 def step_compliance():
     st.header("Arizona Compliance Summary")
     st.caption("Important compliance notes for Arizona lien/waiver forms.")
-    st.markdown(
-        """
-        **Short summary:** Arizona has specific rules for construction waivers/releases and lien notices.
-        This tool provides a fillable waiver/release based on the form templates for Arizona.
-        Make sure you review the generated document for legal accuracy for your project, and consult counsel when necessary.
-        """
-    )
+    st.markdown(AZ_COMPLIANCE_MD)
     st.write("")
     st.info("By continuing you confirm you have read these notes and will use the form responsibly.")
     if st.button("Yes, I understand, please proceed", key="compliance_ack_btn"):
@@ -181,10 +236,11 @@ def step_compliance():
         st.rerun()
     step_navigation(can_go_next=st.session_state.compliance_ack)
 
+@st.fragment
 def step_prescreen_role():
     st.header("Pre-screening — Role")
     st.caption("Select the role you have in this transaction (required).")
-    role = st.selectbox("Your role", options=["", "Owner", "Contractor", "Subcontractor", "Supplier", "Other"], key="role_select_1")
+    role = st.selectbox("Your role", options=ROLE_OPTIONS, key="role_select_1")
     st.session_state.role = role
     if role == "":
         st.warning("Please select your role to proceed.")
@@ -192,19 +248,21 @@ def step_prescreen_role():
     else:
         step_navigation(can_go_next=True)
 
+@st.fragment
 def step_prescreen_payment_type():
     st.header("Pre-screening — Payment Type")
     st.caption("Is this a Progress payment or a Final payment? (required)")
-    payment_type = st.radio("Payment Type", options=["Progress", "Final"], key="payment_type_radio_1")
+    payment_type = st.radio("Payment Type", options=PAYMENT_TYPE_OPTIONS, key="payment_type_radio_1")
     st.session_state.payment_type = payment_type
     st.write("")
     st.caption("Progress = partial / interim payment. Final = final release on project completion.")
     step_navigation(can_go_next=True)
 
+@st.fragment
 def step_prescreen_payment_received():
     st.header("Pre-screening — Payment Received")
     st.caption("Has the payment been received? (required)")
-    received = st.radio("Payment Received?", options=["Yes", "No"], key="payment_received_radio_1")
+    received = st.radio("Payment Received?", options=PAYMENT_RECEIVED_OPTIONS, key="payment_received_radio_1")
     st.session_state.payment_received = received
     if received == "Yes":
         st.success("Marking as received — this will select an Unconditional release template.")
@@ -212,6 +270,7 @@ def step_prescreen_payment_received():
         st.info("Marked as not received — this will select a Conditional release template.")
     step_navigation(can_go_next=True)
 
+@st.fragment
 def step_prescreen_first_delivery():
     st.header("Pre-screening — First Delivery Date")
     st.caption("Enter the first date when materials or labor were delivered (required).")
@@ -219,44 +278,55 @@ def step_prescreen_first_delivery():
     st.session_state.first_delivery_date = first_date
     step_navigation(can_go_next=True)
 
+@st.fragment
 def step_project_payment_details():
     st.header("Project & Payment Details")
     st.caption("All fields required. Use calendar widgets for dates. Format amounts in numbers; $ will be added automatically.")
     st.write("")
-    st.text_input("Project name", key="project_name_input", placeholder="e.g., Highway Renovation #12")
-    st.session_state.project_name = st.session_state.get("project_name_input")
-    st.text_input("Project address", key="project_address_input")
-    st.session_state.project_address = st.session_state.get("project_address_input")
-    st.text_input("Owner name", key="owner_name_input")
-    st.session_state.owner_name = st.session_state.get("owner_name_input")
-    st.text_input("Contractor name", key="contractor_name_input")
-    st.session_state.contractor_name = st.session_state.get("contractor_name_input")
-    st.text_input("Invoice number", key="invoice_number_input")
-    st.session_state.invoice_number = st.session_state.get("invoice_number_input")
-    st.text_input("Payment amount (numbers only)", key="payment_amount_input")
-    st.session_state.payment_amount_raw = st.session_state.get("payment_amount_input")
-    st.date_input("Job start date", key="job_start_date_input")
-    st.session_state.job_start_date = st.session_state.get("job_start_date_input")
-    st.date_input("Job end date", key="job_end_date_input")
-    st.session_state.job_end_date = st.session_state.get("job_end_date_input")
-    st.text_area("Brief job description", key="job_description_input", height=120)
-    st.session_state.job_description = st.session_state.get("job_description_input")
-    required_fields = [
-        st.session_state.project_name,
-        st.session_state.project_address,
-        st.session_state.owner_name,
-        st.session_state.contractor_name,
-        st.session_state.invoice_number,
-        st.session_state.payment_amount_raw,
-        st.session_state.job_start_date,
-        st.session_state.job_end_date,
-        st.session_state.job_description,
-    ]
-    all_filled = all([bool(f) for f in required_fields])
-    if not all_filled:
+    with st.form("project_details_form"):
+        st.text_input("Project name", key="project_name_input", placeholder="e.g., Highway Renovation #12")
+        st.text_input("Project address", key="project_address_input")
+        st.text_input("Owner name", key="owner_name_input")
+        st.text_input("Contractor name", key="contractor_name_input")
+        st.text_input("Invoice number", key="invoice_number_input")
+        st.text_input("Payment amount (numbers only)", key="payment_amount_input")
+        st.date_input("Job start date", key="job_start_date_input")
+        st.date_input("Job end date", key="job_end_date_input")
+        st.text_area("Brief job description", key="job_description_input", height=120)
+        submitted = st.form_submit_button("Next")
+    if submitted:
+        st.session_state.project_name = st.session_state.get("project_name_input")
+        st.session_state.project_address = st.session_state.get("project_address_input")
+        st.session_state.owner_name = st.session_state.get("owner_name_input")
+        st.session_state.contractor_name = st.session_state.get("contractor_name_input")
+        st.session_state.invoice_number = st.session_state.get("invoice_number_input")
+        st.session_state.payment_amount_raw = st.session_state.get("payment_amount_input")
+        st.session_state.job_start_date = st.session_state.get("job_start_date_input")
+        st.session_state.job_end_date = st.session_state.get("job_end_date_input")
+        st.session_state.job_description = st.session_state.get("job_description_input")
+        required_fields = [
+            st.session_state.project_name,
+            st.session_state.project_address,
+            st.session_state.owner_name,
+            st.session_state.contractor_name,
+            st.session_state.invoice_number,
+            st.session_state.payment_amount_raw,
+            st.session_state.job_start_date,
+            st.session_state.job_end_date,
+            st.session_state.job_description,
+        ]
+        all_filled = all(required_fields)
+        if all_filled:
+            st.session_state.step += 1
+            st.rerun()
         st.warning("Please complete all required project and payment details before proceeding.")
-    step_navigation(can_go_next=all_filled)
+    if st.button("Back", key=f"back_btn_{st.session_state.step}"):
+        st.session_state.step = max(0, st.session_state.step - 1)
+        st.rerun()
+    st.write("")
+    st.markdown("---")
 
+@st.fragment
 def step_review_and_generate():
     st.header("Review — Confirm details before generating")
     st.caption("Review all details below. Click Generate to create the Word document.")
@@ -274,9 +344,9 @@ def step_review_and_generate():
     st.write(f"**Payment received:** {st.session_state.payment_received}")
     st.write(f"**Amount:** {currency_format(st.session_state.payment_amount_raw)}")
     st.subheader("Dates")
-    st.write(f"**First delivery:** {st.session_state.first_delivery_date.strftime('%B %d, %Y') if st.session_state.first_delivery_date else ''}")
-    st.write(f"**Job start:** {st.session_state.job_start_date.strftime('%B %d, %Y') if st.session_state.job_start_date else ''}")
-    st.write(f"**Job end:** {st.session_state.job_end_date.strftime('%B %d, %Y') if st.session_state.job_end_date else ''}")
+    st.write(f"**First delivery:** {format_date(st.session_state.first_delivery_date)}")
+    st.write(f"**Job start:** {format_date(st.session_state.job_start_date)}")
+    st.write(f"**Job end:** {format_date(st.session_state.job_end_date)}")
     st.markdown("---")
     st.info("If any detail is incorrect, use Back to edit. All fields are required.")
     if st.button("Generate document", key="generate_doc_btn"):
@@ -292,6 +362,7 @@ def step_review_and_generate():
                 st.error(f"Failed to generate document: {e}")
     step_navigation(can_go_next=True)
 
+@st.fragment
 def step_download():
     st.header("Done — Download your populated form")
     st.caption("Click the button below to download the generated document.")
@@ -300,7 +371,7 @@ def step_download():
             label="Download populated document",
             data=st.session_state.generated_file_bytes,
             file_name=st.session_state.generated_filename,
-            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            mime=DOCX_MIME,
             key="download_populated_doc"
         )
         st.success("If needed, change inputs and regenerate another copy.")
@@ -309,21 +380,67 @@ def step_download():
     step_navigation(can_go_next=False)
 
 # ---------- Document generation ----------
-def extract_template_from_zip(zip_path: str, template_relpath: str, extract_to: str):
-    template_basename = Path(template_relpath).name.lower()
+@st.cache_resource(show_spinner=False)
+def get_zip_member_index(zip_path: str):
+    """Map lowercased member basenames to their full path inside the zip.
+
+    Built once per process so reruns and repeated generations skip the
+    namelist scan entirely. Only Arizona .docx members are indexed; the
+    other states' templates are never read by this app.
+    """
+    folder = ARIZONA_FOLDER_NAME.lower()
     with ZipFile(zip_path, "r") as z:
-        matched_file = None
-        for name in z.namelist():
-            if Path(name).name.lower() == template_basename:
-                matched_file = name
-                break
-        if matched_file is None:
-            all_files = "\n".join(z.namelist())
-            raise FileNotFoundError(
-                f"Could not find template {template_basename} in {zip_path}. Files in zip:\n{all_files}"
-            )
-        z.extract(matched_file, path=extract_to)
-        return Path(extract_to) / matched_file
+        return {
+            Path(name).name.lower(): name
+            for name in z.namelist()
+            if folder in name.lower() and name.lower().endswith(".docx")
+        }
+
+@st.cache_resource(show_spinner=False)
+def get_resolved_template_members(zip_path: str):
+    """Resolve every TEMPLATE_FILENAME_MAP entry to its zip member path once.
+
+    Generation then does a single dict lookup instead of re-matching
+    filenames against the archive on each click.
+    """
+    index = get_zip_member_index(zip_path)
+    resolved = {}
+    for key, filename in TEMPLATE_FILENAME_MAP.items():
+        member = index.get(filename.lower())
+        if member is not None:
+            resolved[key] = member
+    return resolved
+
+@st.cache_resource(show_spinner=False)
+def get_all_template_bytes():
+    """Read all four Arizona template members in a single zip open.
+
+    The first generation warms every template, so switching payment type
+    or conditional status later in the session never reopens the archive.
+    Callers parse a fresh Document from the cached bytes, which is cheaper
+    than deep-copying a shared parsed tree and avoids mutating cached state.
+    """
+    members = get_resolved_template_members(TEMPLATES_ZIP_PATH).values()
+    with ZipFile(TEMPLATES_ZIP_PATH, "r") as z:
+        return {member: z.read(member) for member in members}
+
+def get_template_bytes(member: str) -> bytes:
+    return get_all_template_bytes()[member]
+
+@st.cache_data(show_spinner=False)
+def build_document_bytes(member: str, replacement_items: tuple):
+    """Fill the template and serialize it, memoized on the field values.
+
+    Re-clicking Generate with unchanged inputs returns the cached bytes
+    without re-parsing or re-saving the docx.
+    """
+    from docx import Document  # deferred: lxml import is only needed on generate
+
+    doc = Document(BytesIO(get_template_bytes(member)))
+    replace_docx_placeholders(doc, dict(replacement_items))
+    fbytes = BytesIO()
+    doc.save(fbytes)
+    return fbytes.getvalue()
 
 def generate_document():
     payment_type = st.session_state.payment_type
@@ -332,63 +449,56 @@ def generate_document():
     key = (payment_type, unconditional)
     if key not in TEMPLATE_FILENAME_MAP:
         raise ValueError("Template mapping not found for your selection.")
-    template_filename = TEMPLATE_FILENAME_MAP[key]
-    template_relpath = f"{ARIZONA_FOLDER_NAME}/{template_filename}"
-    tmpdir = tempfile.mkdtemp()
-    try:
-        extracted = extract_template_from_zip(TEMPLATES_ZIP_PATH, template_relpath, tmpdir)
-        doc = Document(str(extracted))
-        replacements = build_replacement_map()
-        replace_docx_placeholders(doc, replacements)
-        fbytes = BytesIO()
-        doc.save(fbytes)
-        fbytes.seek(0)
-        conditional_text = "Unconditional" if unconditional else "Conditional"
-        date_part = datetime.now().strftime("%Y%m%d")
-        progressive_text = payment_type
-        out_filename = f"Lienify_AZ_{progressive_text}_{conditional_text}_{date_part}.docx"
-        out_filename = safe_filename(out_filename)
-        return fbytes.getvalue(), out_filename
-    finally:
-        try:
-            shutil.rmtree(tmpdir)
-        except:
-            pass
+    member = get_resolved_template_members(TEMPLATES_ZIP_PATH).get(key)
+    if member is None:
+        raise FileNotFoundError(
+            f"Could not find template {TEMPLATE_FILENAME_MAP[key]} in {TEMPLATES_ZIP_PATH}."
+        )
+    replacements = build_replacement_map()
+    doc_bytes = build_document_bytes(member, tuple(replacements.items()))
+    conditional_text = "Unconditional" if unconditional else "Conditional"
+    date_part = date.today().strftime("%Y%m%d")
+    progressive_text = payment_type
+    out_filename = f"Lienify_AZ_{progressive_text}_{conditional_text}_{date_part}.docx"
+    out_filename = safe_filename(out_filename)
+    return doc_bytes, out_filename
 
 # ---------- Main App ----------
+STEP_TITLES: Final = (
+    "Welcome",
+    "State Selection",
+    "Compliance",
+    "Role",
+    "Payment Type",
+    "Payment Received",
+    "First Delivery",
+    "Project Details",
+    "Review & Generate",
+    "Download",
+)
+
+STEP_HANDLERS: Final = MappingProxyType({
+    0: step_welcome,
+    1: step_state_selection,
+    2: step_compliance,
+    3: step_prescreen_role,
+    4: step_prescreen_payment_type,
+    5: step_prescreen_payment_received,
+    6: step_prescreen_first_delivery,
+    7: step_project_payment_details,
+    8: step_review_and_generate,
+    9: step_download,
+})
+
 def main():
     st.set_page_config(page_title="Lienify — Waiver & Lien Generator", page_icon="🧾", layout="centered")
     init_session()
     st.write("")
 
-    steps_titles = [
-        "Welcome",
-        "State Selection",
-        "Compliance",
-        "Role",
-        "Payment Type",
-        "Payment Received",
-        "First Delivery",
-        "Project Details",
-        "Review & Generate",
-        "Download"
-    ]
-    st.caption(f"Step {st.session_state.step + 1} of {len(steps_titles)} — {steps_titles[min(st.session_state.step, len(steps_titles)-1)]}")
+    st.caption(f"Step {st.session_state.step + 1} of {len(STEP_TITLES)} — {STEP_TITLES[min(st.session_state.step, len(STEP_TITLES)-1)]}")
     st.markdown("---")
 
-    mapping = {
-        0: step_welcome,
-        1: step_state_selection,
-        2: step_compliance,
-        3: step_prescreen_role,
-        4: step_prescreen_payment_type,
-        5: step_prescreen_payment_received,
-        6: step_prescreen_first_delivery,
-        7: step_project_payment_details,
-        8: step_review_and_generate,
-        9: step_download,
-    }
-    func = mapping.get(st.session_state.step, step_welcome)
+    func = STEP_HANDLERS.get(st.session_state.step, step_welcome)
     func()
 
 if __name__ == "__main__":